@@ -2,24 +2,33 @@
 
 
 import argparse
+import contextlib
 import csv
 import datetime
-import json
+import io
+import itertools
 import logging
+import logging.handlers
+import multiprocessing
 import os
 import pprint
 import re
 import shutil
 import sys
+import tempfile
+import threading
 import traceback
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from types import SimpleNamespace
 
-from bokeh.plotting import figure, show, output_file, save, output_notebook, output_file
+from bokeh.io import save
+from bokeh.plotting import figure
+from bokeh.resources import CDN
 from mako.lookup import TemplateLookup
-from mako.template import Template
+from mako.runtime import Context
 
-from doc_metrics import csv_to_rows_of_strings, RowColumnView, Metrics
+from doc_metrics import Metrics
 
 
 STATUS_OK = 0
@@ -29,7 +38,96 @@ ERROR = 'ERROR'
 DATA_DIR = 'subproject_csvs'
 OUTPUT_DIR = 'metrics_output'
 LOGFILE = 'metrics_build.log'
+CSV_BATCH_ROWS = 50000
+PREFERRED_PROJECT_ORDER = ('Jupyter Notebook', 'JupyterLab', 'JupyterHub', 'Jupyter Server')  # Listed first
+SAFE_NAME_RE = re.compile(r'[^A-Za-z0-9]')  # Chars replaced in output file names
+TEMPLATE_CACHE_DIR = '.mako_cache'  # Compiled templates, reused across runs
 logger = logging.getLogger(__name__)
+template_lookup = TemplateLookup(
+    directories=['templates'],
+    module_directory=TEMPLATE_CACHE_DIR,
+    filesystem_checks=False,
+)
+
+
+def iter_data_files(root):
+    """Recursively yield os.DirEntry objects for files under root
+
+    Walks top-down like os.walk (files in a folder before its subfolders, no
+    symlinked folders), but reuses each DirEntry's path and cached file type
+    instead of re-joining and re-stat'ing paths.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                else:
+                    files.append(entry)
+    except OSError:
+        logger.warning('[BldMetrics]     Could not read folder: %s', root)
+        return
+
+    yield from files
+    for subdir in subdirs:
+        yield from iter_data_files(subdir)
+
+
+def concat_csvs_raw(src_paths, dst_path):
+    """Concatenate CSV files byte for byte, keeping only the first header row
+
+    Only done when every file uses CRLF line endings (as csv.writer writes
+    them), so the output never mixes terminators. Returns True if the
+    files were copied, or False (nothing written) otherwise.
+    """
+    for src_path in src_paths:
+        with open(src_path, 'rb') as src:
+            if not src.readline().endswith(b'\r\n'):
+                return False
+
+    with open(dst_path, 'wb') as dst:
+        for index, src_path in enumerate(src_paths):
+            with open(src_path, 'rb') as src:
+                # Check the last byte so files without a trailing newline
+                # don't get glued onto the next file's first row
+                src.seek(0, os.SEEK_END)
+                ends_with_newline = src.tell() == 0
+                if not ends_with_newline:
+                    src.seek(-1, os.SEEK_END)
+                    ends_with_newline = src.read(1) == b'\n'
+                src.seek(0)
+
+                header = src.readline()
+                if index == 0:
+                    dst.write(header)  # (Repeated headers are skipped)
+                shutil.copyfileobj(src, dst, length=1 << 20)
+                if not ends_with_newline:
+                    dst.write(b'\r\n')
+
+    return True
+
+
+def write_csv_rows(path, headers, rows):
+    """Write headers and rows to a CSV file, serializing them in batches
+
+    Rows are formatted into an in-memory buffer that is written out (one
+    file write per batch) every CSV_BATCH_ROWS rows to cap memory use.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    rows = iter(rows)
+    with open(path, 'w', encoding='utf8', newline='') as csvfile:
+        while True:
+            writer.writerows(itertools.islice(rows, CSV_BATCH_ROWS))
+            if not buffer.tell():
+                break
+            csvfile.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
 
 
 def write_traffic_outputs(proj_name, proj_output_dir, proj_metadata, traffic_metrics):
@@ -37,53 +135,53 @@ def write_traffic_outputs(proj_name, proj_output_dir, proj_metadata, traffic_met
     try:
 
         # Write merged CSV data for users to tinker with if desired
-        logger.info(f'[BldMetrics]   Write merged traffic csv file')
+        logger.info('[BldMetrics]   Write merged traffic csv file')
         merged_csv_path = os.path.join(
             proj_output_dir,
-            re.sub(r'[^A-Za-z0-9]', '_', os.path.basename(proj_name)) + '_traffic.csv'
+            SAFE_NAME_RE.sub('_', os.path.basename(proj_name)) + '_traffic.csv'
         )
-        with open(merged_csv_path, 'w', encoding='utf8', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(traffic_metrics.headers())
-            for row in traffic_metrics:
-                writer.writerow(row)
+        # If the sources needed no cleanup, copy their bytes instead of re-encoding rows
+        source_paths = traffic_metrics.verbatim_source_paths()
+        if not (source_paths and concat_csvs_raw(source_paths, merged_csv_path)):
+            write_csv_rows(merged_csv_path, traffic_metrics.headers(), traffic_metrics.iter_rows_bulk())
         proj_metadata['merged_traffic_csv_path'] = os.path.join('.', merged_csv_path)
         popular_pages = traffic_metrics.most_popular_pages()
         if popular_pages:
             proj_metadata['popular_pages'] = popular_pages
 
         # Compile some data/info from the metrics
-        dates = sorted([
-            datetime.datetime.strptime(d, '%Y-%m-%d %X')
-            for d in traffic_metrics[Metrics.THDRS.DATE]
-        ])
-        unique_dates = sorted(list(set(dates)))
-        proj_metadata['latest_traffic_data_date'] = unique_dates[-1]
-        proj_metadata['traffic_data_span'] = (unique_dates[-1] - unique_dates[0]).days if len(unique_dates) > 1 else 1
+        # (Dates are 'YYYY-MM-DD HH:MM:SS' strings, which sort correctly as text,
+        # so only the earliest/latest values need to be parsed)
+        raw_dates = traffic_metrics[Metrics.THDRS.DATE]
+        unique_count = len(set(raw_dates))
+        earliest = datetime.datetime.fromisoformat(min(raw_dates))
+        latest = datetime.datetime.fromisoformat(max(raw_dates))
+        proj_metadata['latest_traffic_data_date'] = latest
+        proj_metadata['traffic_data_span'] = (latest - earliest).days if unique_count > 1 else 1
         proj_metadata['total_views'] = sum(i[1] for i in popular_pages)
         DAYS_IN_WEEK = 7
-        most_pop = sorted(traffic_metrics.most_popular_pages(25), key=lambda item: item[1])
-        vals_independent = [i[0] for i in most_pop]
-        vals_dependent = [i[1] / len(unique_dates) * DAYS_IN_WEEK for i in most_pop]
-
-        # views = traffic_metrics.total_views()
-        # pop_versions = traffic_metrics.most_popular_versions(25)
+        # Reuse the full ranking (already sorted, most popular first) for the
+        # top 25, reversed so the most popular bar is drawn at the top
+        most_pop = popular_pages[:25][::-1]
+        labels, counts = zip(*most_pop)
+        scale = DAYS_IN_WEEK / unique_count
+        vals_independent = list(labels)
+        vals_dependent = [count * scale for count in counts]
 
         # Write interactive HTML plots
         plot1_path = os.path.join(proj_output_dir, 'popular_pages.html')
         proj_metadata['plot1_path'] = os.path.join('.', plot1_path)
 
         # Build/write the plot to the project output folder
-        p = figure(y_range=[i[0] for i in most_pop], title="Popular Pages (Top 25)", x_axis_label='Avg. Views per Week', y_axis_label='Page', width=625, height=400)
+        p = figure(y_range=vals_independent, title="Popular Pages (Top 25)", x_axis_label='Avg. Views per Week', y_axis_label='Page', width=625, height=400)
         p.hbar(y=vals_independent, right=vals_dependent)
 
-        output_file(filename=plot1_path, title="Static HTML file")
-        save(p)
+        save(p, filename=plot1_path, resources=CDN, title="Static HTML file")
 
     except Exception as err:
         tb = traceback.format_exc()
-        logger.error('[BldMetrics]   [E] Exception occurred, details:\n' + tb)
-        logger.error(f'[BldMetrics]   [E] Error writing traffic outputs for: {proj_name}')
+        logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
+        logger.error('[BldMetrics]   [E] Error writing traffic outputs for: %s', proj_name)
 
 
 def write_search_outputs(proj_name, proj_output_dir, proj_metadata, search_metrics):
@@ -91,77 +189,216 @@ def write_search_outputs(proj_name, proj_output_dir, proj_metadata, search_metri
     try:
 
         # Write merged CSV data for users to tinker with if desired
-        logger.info(f'[BldMetrics]   Write merged search csv file')
+        logger.info('[BldMetrics]   Write merged search csv file')
         merged_csv_path = os.path.join(
             proj_output_dir,
-            re.sub(r'[^A-Za-z0-9]', '_', os.path.basename(proj_name)) + '_search.csv'
+            SAFE_NAME_RE.sub('_', os.path.basename(proj_name)) + '_search.csv'
         )
-        with open(merged_csv_path, 'w', encoding='utf8', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(search_metrics.headers())
-            for row in search_metrics:
-                writer.writerow(row)
+        # If the sources needed no cleanup, copy their bytes instead of re-encoding rows
+        source_paths = search_metrics.verbatim_source_paths()
+        if not (source_paths and concat_csvs_raw(source_paths, merged_csv_path)):
+            write_csv_rows(merged_csv_path, search_metrics.headers(), search_metrics.iter_rows_bulk())
         proj_metadata['merged_search_csv_path'] = os.path.join('.', merged_csv_path)
         popular_searches = search_metrics.most_popular_queries()
         if popular_searches:
             proj_metadata['popular_searches'] = popular_searches
 
         # Compile some data/info from the metrics
-        dates = sorted([
-            datetime.datetime.strptime(d, '%Y-%m-%d %X')
-            for d in search_metrics[Metrics.SHDRS.CREATED_DATE]
-        ])
-        unique_dates = sorted(list(set(dates)))
-        proj_metadata['latest_search_data_date'] = unique_dates[-1]
-        proj_metadata['search_data_span'] = (unique_dates[-1] - unique_dates[0]).days if len(unique_dates) > 1 else 1
+        raw_dates = search_metrics[Metrics.SHDRS.CREATED_DATE]
+        unique_count = len(set(raw_dates))
+        earliest = datetime.datetime.fromisoformat(min(raw_dates))
+        latest = datetime.datetime.fromisoformat(max(raw_dates))
+        proj_metadata['latest_search_data_date'] = latest
+        proj_metadata['search_data_span'] = (latest - earliest).days if unique_count > 1 else 1
         proj_metadata['total_searches'] = sum(i[1] for i in popular_searches)
         DAYS_IN_WEEK = 7
-        most_pop = sorted(search_metrics.most_popular_queries(25), key=lambda item: item[1])
-        vals_independent = [i[0] for i in most_pop]
-        vals_dependent = [i[1] / len(unique_dates) * DAYS_IN_WEEK for i in most_pop]
+        most_pop = popular_searches[:25][::-1]
+        labels, counts = zip(*most_pop)
+        scale = DAYS_IN_WEEK / unique_count
+        vals_independent = list(labels)
+        vals_dependent = [count * scale for count in counts]
 
         # Write interactive HTML plots
         plot2_path = os.path.join(proj_output_dir, 'popular_queries.html')
         proj_metadata['plot2_path'] = os.path.join('.', plot2_path)
 
         # Build/write the plot to the project output folder
-        p = figure(y_range=[i[0] for i in most_pop], title="Popular Searches (Top 25)", x_axis_label='Searches per Week', y_axis_label='Page', width=625, height=400)
+        p = figure(y_range=vals_independent, title="Popular Searches (Top 25)", x_axis_label='Searches per Week', y_axis_label='Page', width=625, height=400)
         p.hbar(y=vals_independent, right=vals_dependent)
 
-        output_file(filename=plot2_path, title="Static HTML file")
-        save(p)
+        save(p, filename=plot2_path, resources=CDN, title="Static HTML file")
 
     except Exception as err:
         tb = traceback.format_exc()
-        logger.error('[BldMetrics]   [E] Exception occurred, details:\n' + tb)
-        logger.error(f'[BldMetrics]   [E] Error writing search outputs for: {proj_name}')
+        logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
+        logger.error('[BldMetrics]   [E] Error writing search outputs for: %s', proj_name)
+
+
+def merge_csvs(csv_paths):
+    """Merge same-type CSVs into one Metrics object, leaving out bad files
+
+    Runs in a worker process. Returns a (metrics, failures) tuple, where
+    failures lists (path, traceback) for files that can't be loaded on their
+    own (metrics is None if no file loaded). If every file loads by itself,
+    an error merging them is raised as is.
+    """
+    try:
+        return Metrics.build(path=csv_paths), []
+    except Exception as err:
+        merge_error = err
+
+    # Load each file separately to find the one(s) that broke the merge
+    good_paths = []
+    failures = []
+    for csv_path in csv_paths:
+        try:
+            Metrics.build(path=csv_path)
+            good_paths.append(csv_path)
+        except Exception:
+            failures.append((csv_path, traceback.format_exc()))
+    if not failures:
+        raise merge_error
+    if not good_paths:
+        return None, failures
+    return Metrics.build(path=good_paths), failures
+
+
+def collect_merged_csvs(job, csv_paths, problems):
+    """Get a merge_csvs() job's result, reporting (and dropping) bad files"""
+    metrics, failures = job.result()
+    for csv_path, tb in failures:
+        logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
+        logger.error('[BldMetrics]       [E] Error during file read: %s', csv_path)
+        problems.append((ERROR, 'FILE_READ_ERR', csv_path, tb))
+        csv_paths.remove(csv_path)
+    return metrics
+
+
+def render_project_outputs(task):
+    """Write all outputs for one subproject, return its updated metadata
+
+    Takes a (proj_name, proj_output_dir, proj_metadata, traffic_metrics,
+    search_metrics) tuple so it can be mapped over a process pool.
+    """
+    proj_name, proj_output_dir, proj_metadata, traffic_metrics, search_metrics = task
+
+    # Traffic and search outputs go to separate files, so overlap them
+    # (plots are saved without touching Bokeh's global output state)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        jobs = []
+
+        # Build outputs for traffic data
+        if traffic_metrics:
+            jobs.append(executor.submit(
+                write_traffic_outputs, proj_name, proj_output_dir, proj_metadata, traffic_metrics
+            ))
+
+        # Build outputs for search data
+        if search_metrics:
+            jobs.append(executor.submit(
+                write_search_outputs, proj_name, proj_output_dir, proj_metadata, search_metrics
+            ))
+
+        for job in jobs:
+            job.result()
+
+    return proj_metadata
+
+
+def init_worker_logging(log_queue, level):
+    """Send a worker process's log records to the main process via a queue
+
+    Used as a process pool initializer. Any handlers already set up in the
+    worker are replaced, so each record is written once, by the main
+    process's handlers (see forward_worker_logs()).
+    """
+    logger.handlers.clear()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(level)
+
+
+@contextlib.contextmanager
+def forward_worker_logs():
+    """Collect log records from process pool workers while in this context
+
+    Yields ProcessPoolExecutor keyword arguments that set up the workers'
+    logging, so records from workers reach this process's handlers (log
+    file and console). The listener runs in a thread, so workers are never
+    forked from this process: they come from a forkserver (or are spawned
+    where that isn't available).
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('forkserver')
+    else:
+        mp_context = multiprocessing.get_context('spawn')
+    log_queue = mp_context.Queue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue, *logger.handlers, respect_handler_level=True
+    )
+    log_listener.start()
+    try:
+        yield {
+            'mp_context': mp_context,
+            'initializer': init_worker_logging,
+            'initargs': (log_queue, logger.level),
+        }
+    finally:
+        # Handles any records still queued before returning
+        log_listener.stop()
+
+
+def remove_dirs(paths):
+    """Delete folders (and their contents), ignoring errors"""
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
 
 
 def build_metrics():
     logger.info('[BldMetrics] **** Begin metrics build ****')
-    logger.info(f'[BldMetrics] Started at {datetime.datetime.now().isoformat()}')
+    logger.info('[BldMetrics] Started at %s', datetime.datetime.now().isoformat())
 
     # Hold/build compiled info about every project here
     all_project_metadata = {}
+    stale_output_dir = None
+    cleanup_thread = None
     if os.path.exists(OUTPUT_DIR):
         try:
-            shutil.rmtree(OUTPUT_DIR)
+            # Move old outputs aside and delete them in the background while
+            # the build runs, instead of waiting on a full rmtree here
+            # (into a new uniquely named folder, so leftovers from earlier
+            # interrupted builds can't get in the way)
+            leftover_dirs = [
+                entry.path for entry in os.scandir('.')
+                if entry.name.startswith(f'{OUTPUT_DIR}.old.') and entry.is_dir()
+            ]
+            stale_output_dir = tempfile.mkdtemp(prefix=f'{OUTPUT_DIR}.old.', dir='.')
+            os.rename(OUTPUT_DIR, os.path.join(stale_output_dir, OUTPUT_DIR))
+            cleanup_thread = threading.Thread(
+                target=remove_dirs,
+                args=([stale_output_dir] + leftover_dirs,),
+                daemon=True,
+            )
+            cleanup_thread.start()
             os.makedirs(OUTPUT_DIR, exist_ok=True)
-            logger.info(f'[BldMetrics] Old outputs removed successfully')
+            logger.info('[BldMetrics] Old outputs moved aside for removal')
         except Exception as err:
             tb = traceback.format_exc()
-            logger.error('[BldMetrics]   [E] Exception occurred, details:\n' + tb)
+            logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
             raise Exception('[E] Error removing old output files') from err
 
     # Start looking for subproject folders in the data dir
     problems = []  # A simple list with string tuples describing warnings/errors
-    for proj_path in os.listdir(DATA_DIR):
-        proj_dir = os.path.join(os.path.abspath(DATA_DIR), proj_path)
-        logger.info(f'\n[BldMetrics] Checking item in data path: {proj_path}')
+    merge_queue = []  # (proj_path, proj_dir, traffic_csvs, search_csvs) per project
+    with os.scandir(os.path.abspath(DATA_DIR)) as data_entries:
+        proj_entries = list(data_entries)
+    for proj_entry in proj_entries:
+        proj_path = proj_entry.name
+        proj_dir = proj_entry.path
+        logger.info('\n[BldMetrics] Checking item in data path: %s', proj_path)
 
         # CSV files should only be inside a subproj folder
-        if not os.path.isdir(proj_dir):
-            logger.warning(f'[BldMetrics]   Skipped orphan file in project folder: {proj_dir}')
+        if not proj_entry.is_dir():
+            logger.warning('[BldMetrics]   Skipped orphan file in project folder: %s', proj_dir)
             continue
 
         # Compile project metadata here
@@ -195,120 +432,161 @@ def build_metrics():
         proj_search_csvs = []
         proj_metadata['traffic_inputs'] = proj_traffic_csvs
         proj_metadata['search_inputs'] = proj_search_csvs
-        for dirpath, dirnames, filenames in os.walk(proj_dir):
-            for target in filenames:
-                tgt_path = os.path.join(dirpath, target)
-                if not target.lower().endswith('.csv'):
-                    logger.warning(f'[BldMetrics]     Skip file: {os.path.relpath(os.path.join(dirpath, target), DATA_DIR)}')
-                    problems.append((WARNING, 'SKIPPED_FILE', tgt_path))
-                    continue
+        for entry in iter_data_files(proj_dir):
+            tgt_path = entry.path
+            if entry.name[-4:].lower() != '.csv':
+                if logger.isEnabledFor(logging.WARNING):
+                    logger.warning('[BldMetrics]     Skip file: %s', os.path.relpath(tgt_path, DATA_DIR))
+                problems.append((WARNING, 'SKIPPED_FILE', tgt_path))
+                continue
+
+            # Load the CSV and check if it's valid
+            try:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('[BldMetrics]     Load CSV: %s', os.path.relpath(tgt_path, DATA_DIR))
+                # (Only the header/first row are read here, the full parse
+                # happens once, when the project's CSVs are merged below)
+                metrics_type, is_empty = Metrics.classify(tgt_path)
+                if metrics_type is None:
+                    logger.error('[BldMetrics]       [E] Bad CSV format: %s', tgt_path)
+                    problems.append((ERROR, 'BAD_CSV_FMT', tgt_path))
 
-                # Load the CSV and check if it's valid
-                try:
-                    logger.info(f'[BldMetrics]     Load CSV: {os.path.relpath(os.path.join(dirpath, tgt_path), DATA_DIR)}')
-                    met = Metrics.build(path=tgt_path)
-                    if not (met.is_traffic() or met.is_search()):
-                        logger.error(f'[BldMetrics]       [E] Bad CSV format: {tgt_path}')
-                        problems.append((ERROR, 'BAD_CSV_FMT', tgt_path))
-
-                        continue
-                    if met.is_empty():
-                        if met.is_traffic():
-                            logger.warning(f'[BldMetrics]       [W] Bad traffic CSV (Empty data rows): {tgt_path}')
-                            proj_metadata['traffic_empty'] = True
-                        if met.is_search():
-                            logger.warning(f'[BldMetrics]       [W] Bad search CSV (Empty data rows): {tgt_path}')
-                            proj_metadata['search_empty'] = True
-                        problems.append((WARNING, 'EMPTY_CSV', tgt_path))
-
-                        continue
-
-                    # Add the path to the right target path list
-                    if met.is_traffic():
-                        proj_traffic_csvs.append(tgt_path)
-                        logger.info(f'[BldMetrics]       Traffic data found')
-                    if met.is_search():
-                        proj_search_csvs.append(tgt_path)
-                        logger.info(f'[BldMetrics]       Search data found')
-
-                except Exception as err:
-                    tb = traceback.format_exc()
-                    logger.error('[BldMetrics]   [E] Exception occurred, details:\n' + tb)
-                    logger.error(f'[BldMetrics]       [E] Error during file read: {tgt_path}')
-                    problems.append((ERROR, 'FILE_READ_ERR', tgt_path, tb))
+                    continue
+                if is_empty:
+                    if metrics_type == Metrics.TYPES.TRAFFIC:
+                        logger.warning('[BldMetrics]       [W] Bad traffic CSV (Empty data rows): %s', tgt_path)
+                        proj_metadata['traffic_empty'] = True
+                    if metrics_type == Metrics.TYPES.SEARCH:
+                        logger.warning('[BldMetrics]       [W] Bad search CSV (Empty data rows): %s', tgt_path)
+                        proj_metadata['search_empty'] = True
+                    problems.append((WARNING, 'EMPTY_CSV', tgt_path))
 
                     continue
 
+                # Add the path to the right target path list
+                if metrics_type == Metrics.TYPES.TRAFFIC:
+                    proj_traffic_csvs.append(tgt_path)
+                    logger.debug('[BldMetrics]       Traffic data found')
+                if metrics_type == Metrics.TYPES.SEARCH:
+                    proj_search_csvs.append(tgt_path)
+                    logger.debug('[BldMetrics]       Search data found')
+
+            except Exception as err:
+                tb = traceback.format_exc()
+                logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
+                logger.error('[BldMetrics]       [E] Error during file read: %s', tgt_path)
+                problems.append((ERROR, 'FILE_READ_ERR', tgt_path, tb))
+
+                continue
+
         if not (proj_traffic_csvs or proj_search_csvs):
             logger.warning('[BldMetrics]   Warning: No valid metrics were found for this project...')
-            problems.append((WARNING, 'MISSING_METRICS', os.path.basename(proj_dir)))
+            problems.append((WARNING, 'MISSING_METRICS', proj_path))
             continue
 
-        # Merge/compile metrics by type
-        logger.info('[BldMetrics]   Begin metrics merge...')
-        try:
-            # Build aggregated traffic data
-            if proj_traffic_csvs:
-                traffic_metrics = Metrics.build(path=proj_traffic_csvs)
+        # Queue the project's CSVs to be merged (see below)
+        merge_queue.append((proj_path, proj_dir, proj_traffic_csvs, proj_search_csvs))
+
+    # Parsing and merging CSVs is CPU bound and every project is independent,
+    # so merge/compile metrics by type in parallel worker processes
+    with forward_worker_logs() as worker_setup, ProcessPoolExecutor(**worker_setup) as executor:
+        merge_jobs = []
+        for proj_path, proj_dir, proj_traffic_csvs, proj_search_csvs in merge_queue:
+            traffic_job = executor.submit(merge_csvs, proj_traffic_csvs) if proj_traffic_csvs else None
+            search_job = executor.submit(merge_csvs, proj_search_csvs) if proj_search_csvs else None
+            merge_jobs.append((proj_path, proj_dir, traffic_job, search_job))
+
+        for proj_path, proj_dir, traffic_job, search_job in merge_jobs:
+            proj_metadata = all_project_metadata[proj_path]
+            proj_traffic_csvs = proj_metadata['traffic_inputs']
+            proj_search_csvs = proj_metadata['search_inputs']
+            logger.info('[BldMetrics]   Begin metrics merge for: %s', proj_path)
+
+            # Files that fail to load are reported and left out of the merge
+            # (see merge_csvs()), the rest of the project's data is still used
+            traffic_metrics = None
+            search_metrics = None
+            try:
+                # Build aggregated traffic data
+                if traffic_job is not None:
+                    traffic_metrics = collect_merged_csvs(traffic_job, proj_traffic_csvs, problems)
+            except Exception as err:
+                tb = traceback.format_exc()
+                logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
+                logger.error('[BldMetrics]     [E] Error merging/building traffic CSVs: %s', proj_dir)
+                problems.append((ERROR, 'ERR_MERGING_TRAFFIC_CSVS', proj_path, tb))
+            try:
+                # Build aggregated search data
+                if search_job is not None:
+                    search_metrics = collect_merged_csvs(search_job, proj_search_csvs, problems)
+            except Exception as err:
+                tb = traceback.format_exc()
+                logger.error('[BldMetrics]   [E] Exception occurred, details:\n%s', tb)
+                logger.error('[BldMetrics]     [E] Error merging/building search CSVs: %s', proj_dir)
+                problems.append((ERROR, 'ERR_MERGING_SEARCH_CSVS', proj_path, tb))
+
+            if not (proj_traffic_csvs or proj_search_csvs):
+                logger.warning('[BldMetrics]   Warning: No valid metrics were found for this project...')
+                problems.append((WARNING, 'MISSING_METRICS', proj_path))
+                continue
+
+            if traffic_metrics is not None:
                 proj_metadata['traffic_data'] = traffic_metrics
                 logger.info('[BldMetrics]     ...merged traffic CSVs')
-            else:
-                logger.warning(f'[BldMetrics]     Warning: no traffic metrics!')
-                problems.append((WARNING, 'NO_TRAFFIC_DATA', os.path.basename(proj_dir)))
-        except Exception as err:
-            tb = traceback.format_exc()
-            logger.error('[BldMetrics]   [E] Exception occurred, details:\n' + tb)
-            logger.error(f'[BldMetrics]     [E] Error merging/building traffic CSVs: {proj_dir}')
-            problems.append((ERROR, 'ERR_MERGING_TRAFFIC_CSVS', os.path.basename(proj_dir), tb))
-        try:
-            # Build aggregated search data
-            if proj_search_csvs:
-                search_metrics = Metrics.build(path=proj_search_csvs)
+            elif not proj_traffic_csvs:
+                logger.warning('[BldMetrics]     Warning: no traffic metrics!')
+                problems.append((WARNING, 'NO_TRAFFIC_DATA', proj_path))
+            if search_metrics is not None:
                 proj_metadata['search_data'] = search_metrics
                 logger.info('[BldMetrics]     ...merged search CSVs')
-            else:
-                logger.warning(f'[BldMetrics]     Warning: no search metrics!')
-                problems.append((WARNING, 'NO_SEARCH_DATA', os.path.basename(proj_dir)))
-        except Exception as err:
-            tb = traceback.format_exc()
-            logger.error('[BldMetrics]   [E] Exception occurred, details:\n' + tb)
-            logger.error(f'[BldMetrics]     [E] Error merging/building search CSVs: {proj_dir}')
-            problems.append((ERROR, 'ERR_MERGING_SEARCH_CSVS', os.path.basename(proj_dir), tb))
+            elif not proj_search_csvs:
+                logger.warning('[BldMetrics]     Warning: no search metrics!')
+                problems.append((WARNING, 'NO_SEARCH_DATA', proj_path))
 
     # Build outputs/reporting for each subproject
     logger.error('\n[BldMetrics] ---- Begin output generation ----')
-    proj_order = [item for item in ['Jupyter Notebook', 'JupyterLab', 'JupyterHub', 'Jupyter Server'] if item in all_project_metadata]
-    proj_order.extend(item for item in all_project_metadata if item not in proj_order)
-    for proj_name, proj_metadata in all_project_metadata.items():
+    proj_order = [item for item in PREFERRED_PROJECT_ORDER if item in all_project_metadata]
+    preferred = set(proj_order)
+    proj_order.extend(item for item in all_project_metadata if item not in preferred)
+    render_tasks = []
+    for proj_name in proj_order:
+        proj_metadata = all_project_metadata[proj_name]
         traffic_metrics = proj_metadata['traffic_data']
         search_metrics = proj_metadata['search_data']
+        proj_basename = os.path.basename(proj_name)
         if traffic_metrics is None and search_metrics is None:
-            logger.warning(f'[BldMetrics] Skipping outputs for project without valid data: {proj_name}')
-            problems.append((WARNING, 'NO_METRICS', os.path.basename(proj_name)))
+            logger.warning('[BldMetrics] Skipping outputs for project without valid data: %s', proj_name)
+            problems.append((WARNING, 'NO_METRICS', proj_basename))
             continue
 
         # Ensure destination/output dirs exist before writing outputs to disk
         try:
-            logger.info(f'[BldMetrics] Making output folder for: {os.path.basename(proj_name)}')
-            proj_output_dir = os.path.join(OUTPUT_DIR, os.path.basename(proj_name))
+            logger.info('[BldMetrics] Making output folder for: %s', proj_basename)
+            proj_output_dir = os.path.join(OUTPUT_DIR, proj_basename)
             os.makedirs(proj_output_dir, exist_ok=True)
         except Exception:
             pass
         if not os.path.exists(proj_output_dir):
             raise Exception('  Could not make output directory!')
 
-        # Build outputs for traffic data
-        if traffic_metrics:
-            write_traffic_outputs(proj_name, proj_output_dir, proj_metadata, traffic_metrics)
+        # Queue the project for output generation (the merged data is passed
+        # separately so it isn't pickled twice along with the metadata)
+        output_metadata = {
+            key: value for key, value in proj_metadata.items()
+            if key not in ('traffic_data', 'search_data')
+        }
+        render_tasks.append((proj_name, proj_output_dir, output_metadata, traffic_metrics, search_metrics))
 
-        # Build outputs for search data
-        if search_metrics:
-            write_search_outputs(proj_name, proj_output_dir, proj_metadata, search_metrics)
+    # Projects are independent and plot rendering is CPU heavy, so build
+    # the outputs for each project in parallel worker processes
+    with forward_worker_logs() as worker_setup, ProcessPoolExecutor(**worker_setup) as executor:
+        rendered = executor.map(render_project_outputs, render_tasks)
+        for task, output_metadata in zip(render_tasks, rendered):
+            all_project_metadata[task[0]].update(output_metadata)
 
     # Build the summary page, with a section for each subproject found in the DATA_DIR
     # (Mako consumes the homepage HTML template file and adds entries per subproject)
-    metrics_lookup = TemplateLookup(directories=['templates'])
-    metrics_page_templ = metrics_lookup.get_template("index.html.template")
+    metrics_page_templ = template_lookup.get_template("index.html.template")
     # Turn project dicts into objects for easy access in the template
     project_page_values = [
         SimpleNamespace(
@@ -316,11 +594,28 @@ def build_metrics():
             **all_project_metadata[key]
         ) for key in proj_order
     ]
-    output_page = metrics_page_templ.render(
-        subprojects=project_page_values
-    )
-    with open(r'index.html', 'w', encoding='utf8') as fhandle:
-        fhandle.write(output_page)
+    # (Render straight into a file rather than building the page as one string.
+    # The file is swapped in when complete, so a failed render never leaves a
+    # truncated index.html behind)
+    page_tmp_path = f'index.html.{os.getpid()}.tmp'
+    try:
+        with open(page_tmp_path, 'w', encoding='utf8') as fhandle:
+            page_context = Context(fhandle, subprojects=project_page_values)
+            metrics_page_templ.render_context(page_context)
+        os.replace(page_tmp_path, r'index.html')
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(page_tmp_path)
+        raise
+
+    # Finish removing old outputs (it ran alongside the whole build)
+    if cleanup_thread is not None:
+        cleanup_thread.join()
+        if os.path.exists(stale_output_dir):
+            logger.warning('[BldMetrics] Could not fully remove old outputs: %s', stale_output_dir)
+            problems.append((WARNING, 'STALE_OUTPUTS', stale_output_dir))
+        else:
+            logger.info('[BldMetrics] Old outputs removed successfully')
 
     return problems
 
@@ -340,12 +635,18 @@ if __name__ == '__main__':
         action='store_true',
         help='Force failure when warnings OR errors occur',
     )
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Show per-file progress in the terminal (always in the log file)',
+    )
     args = parser.parse_args()
 
     # Set up logs
     logger.setLevel(logging.DEBUG)
     # formatter = logging.Formatter('%(message)s')
     console_output_handler = logging.StreamHandler()
+    console_output_handler.setLevel(logging.DEBUG if args.verbose else logging.INFO)
     logfile_handler = logging.FileHandler(
         filename=LOGFILE,
         encoding='utf8',
@@ -359,7 +660,7 @@ if __name__ == '__main__':
 
     # Manually set a return code if needed based on supplied terminal args
     exit_code = STATUS_OK
-    logger.info(f'\n[BldMetrics] Summary of issues ({len(problems)}){":" + chr(10) if problems else ": (None)"}')
+    logger.info('\n[BldMetrics] Summary of issues (%s)%s', len(problems), ':\n' if problems else ': (None)')
     logger.info(pprint.pformat(problems))
     if problems and (args.strict_errors or args.strict_warnings):
         # Only force a non-zero exit code when strict args are used
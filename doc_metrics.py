@@ -3,7 +3,10 @@
 
 import collections
 import csv
+import functools
 import io
+import itertools
+import operator
 
 from types import SimpleNamespace
 
@@ -22,26 +25,17 @@ def csv_to_rows_of_strings(csv_string=None, filehandle=None, path=None):
     :param path: str, Path on disk to a CSV file.
     """
 
-    # Dump whatever data source into a BytesIO object,
-    # then read it with the CSV reader
-    data = io.StringIO()
+    # Stream the data source straight into the CSV reader (no extra copy
+    # of the whole file in memory)
     if csv_string is not None:
-        data.write(csv_string)
+        return list(csv.reader(io.StringIO(csv_string)))
     elif filehandle is not None:
-        data.write(filehandle.read())
+        return list(csv.reader(filehandle))
     elif path is not None:
         with open(path, encoding='utf8', newline='') as csvfile:
-            data.write(csvfile.read())
+            return list(csv.reader(csvfile))
     else:
         raise Exception("Must provide a source for data!")
-    # Put seek position at 0 (like an unread file)
-    data.seek(0)
-
-    rows = []
-    reader = csv.reader(data)
-    for row in reader:
-        rows.append(row)
-    return rows
 
 
 class RowColumnView:
@@ -63,67 +57,90 @@ class RowColumnView:
         - "ColumnName" in mydata  # Check if sheet has header/column name
         - Get a copy of all rows/columns with rows(), columns()
         - Lazy load rows/columns with rowsi(), columni(), columnsi()
+        - Read-only bulk row iteration (no copies) with iter_rows_bulk()
     """
 
     def __init__(self, rows_of_strings):
         if len(rows_of_strings) == 0:
             raise Exception('Empty CSV with no headers!')
 
-        if len(rows_of_strings) == 1:
-            # Has headers but no data (empty data rows)
-            self._rows = []
-        else:
-            self._rows = rows_of_strings[1:]
+        # Keep the source list as is (no copy), data rows start after the
+        # headers at self._row_start (with headers only, there is no data)
+        self._rows = rows_of_strings
+        self._row_start = 1
         self._headers = rows_of_strings[0]
+        self._headers_set = frozenset(self._headers)
+
+        # Map column names to positions (first match wins, like list.index)
+        self._header_indices = {}
+        for index, header in enumerate(self._headers):
+            self._header_indices.setdefault(header, index)
 
     def __getitem__(self, item):
         # Column names return a column
         if isinstance(item, str):
-            if item not in self._headers:
+            index = self._header_indices.get(item)
+            if index is None:
                 raise ValueError("Column name must be in known headers()!")
-            index = self._headers.index(item)
-            return [row[index] for row in self._rows]
+            return [row[index] for row in self._data_rows()]
         elif isinstance(item, int):
-            return self._rows[item]
+            # Resolve negative indexes against the data rows only, so they
+            # never reach the header row
+            position = item + len(self) if item < 0 else item
+            if not 0 <= position < len(self):
+                raise IndexError('Row index out of range')
+            return self._rows[position + self._row_start]
         else:
             raise ValueError("Must provide a string column name or row index!")
 
     def __contains__(self, item):
-        if item in self._rows[0]:
+        if item in self[0]:
             return True
         return False
 
     def __len__(self):
-        return len(self._rows)
+        return len(self._rows) - self._row_start
 
     def __iter__(self):
-        return (list(row) for row in self._rows)
+        return (list(row) for row in self._data_rows())
+
+    def _data_rows(self):
+        # Iterator over the stored data rows (no copies, no header row)
+        return itertools.islice(self._rows, self._row_start, None)
 
     def is_empty(self):
-        return len(self._rows) == 0
+        return len(self) == 0
 
     def headers(self):
         return list(self._headers)
 
     def rowsi(self):
         # Iterator (lazy load) over rows
-        return (list(row) for row in self._rows)
+        return (list(row) for row in self._data_rows())
 
     def rows(self):
         return [list(row) for row in self.rowsi()]
 
+    def iter_rows_bulk(self):
+        # Iterator over the stored rows. Rows are not copied (unlike rowsi()),
+        # so treat them as read-only
+        return self._data_rows()
+
     def col_index(self, column_name):
-        return self._headers.index(column_name)
+        index = self._header_indices.get(column_name)
+        if index is None:
+            raise ValueError(f'{column_name!r} is not in headers')
+        return index
 
     def columni(self, item):
         # Iterator (lazy-load) over a column
         if isinstance(item, str):
-            if item not in self._headers:
+            index = self._header_indices.get(item)
+            if index is None:
                 raise ValueError("Column name must be in known headers()!")
-            index = self._headers.index(item)
-            return (row[index] for row in self._rows)
+            return (row[index] for row in self._data_rows())
         elif isinstance(item, int):
-            return (row[item] for row in self._rows)
+            return (row[item] for row in self._data_rows())
         else:
             raise TypeError("Must provide a string column name or row index!")
 
@@ -158,6 +175,9 @@ class Metrics(RowColumnView):
     SHDRS = SEARCH_HEADERS
     SEARCH_HDR_LIST = [SEARCH_HEADERS.CREATED_DATE, SEARCH_HEADERS.QUERY,
                        SEARCH_HEADERS.TOTAL_RESULTS]
+    # Column name sets, for cheap "has all expected columns" checks
+    TRAFFIC_HDR_SET = frozenset(TRAFFIC_HDR_LIST)
+    SEARCH_HDR_SET = frozenset(SEARCH_HDR_LIST)
     INPUTS = SimpleNamespace(
         CSV_STRING='CSV_STRING',
         FILEHANDLE='FILEHANDLE',
@@ -169,31 +189,54 @@ class Metrics(RowColumnView):
         sheet = RowColumnView(rows_of_strings)
         normalized_data = self._normalize_sheet(sheet)
 
+        self._init_normalized(normalized_data)
+
+    def _init_normalized(self, normalized_data):
         super().__init__(normalized_data)
 
+        # Source CSV paths whose data rows (concatenated) are exactly this
+        # sheet's rows, when known (see verbatim_source_paths())
+        self._verbatim_paths = None
+        # Views column as ints, parsed on first use (see _view_counts())
+        self._views = None
+
+    @classmethod
+    def _from_normalized(cls, normalized_data):
+        """Make a sheet from rows already normalized, skipping validation"""
+        metrics = cls.__new__(cls)
+        metrics._init_normalized(normalized_data)
+        return metrics
+
     @staticmethod
     def _normalize_sheet(sheet):
         """Take a RowColumnView and return plain rows of string lists, normalized"""
         # Keep only expected columns in expected order
-        if not (set(sheet.headers()) >= set(Metrics.TRAFFIC_HDR_LIST)
-                or (set(sheet.headers()) >= set(Metrics.SEARCH_HDR_LIST))):
+        if not (sheet._headers_set >= Metrics.TRAFFIC_HDR_SET
+                or (sheet._headers_set >= Metrics.SEARCH_HDR_SET)):
             raise ValueError('Must provide valid traffic or search CSV data')
 
         # Figure out which columns we need to pull data from
         target_headers = (
             Metrics.TRAFFIC_HDR_LIST
-            if set(sheet.headers()) >= set(Metrics.TRAFFIC_HDR_LIST)
+            if sheet._headers_set >= Metrics.TRAFFIC_HDR_SET
             else Metrics.SEARCH_HDR_LIST
         )
 
-        # Build rows with proper colnames and ordering
+        # Sheets already in the expected layout (every row included) are
+        # reused as they are, rows aren't copied
         normalized_rows = [list(target_headers)]
-        for dirty_row in sheet:
-            norm_row = [
-                dirty_row[sheet.col_index(colname)]
-                for colname in target_headers
-            ]
-            normalized_rows.append(norm_row)
+        if (sheet.headers() == target_headers
+                and set(map(len, sheet._data_rows())) <= {len(target_headers)}):
+            normalized_rows.extend(sheet._data_rows())
+            return normalized_rows
+
+        # Otherwise pick out the needed cells, with the source column
+        # positions looked up once (not once per cell)
+        source_indices = [sheet.col_index(colname) for colname in target_headers]
+        get_cells = operator.itemgetter(*source_indices)
+
+        # Build rows with proper colnames and ordering
+        normalized_rows.extend(map(list, map(get_cells, sheet._data_rows())))
 
         # Return string rows, for use with the base class constructor
         return normalized_rows
@@ -206,53 +249,45 @@ class Metrics(RowColumnView):
         # are duplicates (and query match count may differ but is not relevant for metrics)
         sheet = RowColumnView(rows_of_strings)
         source_headers = sheet.headers()
-        if (not (set(source_headers) >= set(Metrics.SEARCH_HDR_LIST))
-                and (not set(source_headers) >= set(Metrics.TRAFFIC_HDR_LIST))):
+        if (not (sheet._headers_set >= Metrics.SEARCH_HDR_SET)
+                and (not sheet._headers_set >= Metrics.TRAFFIC_HDR_SET)):
             raise ValueError('Cannot clean unknown CSV formats')
         cleaned = []
 
-        # Clean exact duplicates where all columns are the same
+        # Clean exact duplicates where all columns are the same (the dict
+        # keeps the first occurrence of each row, in order)
         no_exact_row_duplicates = [source_headers]
-        full_row_map = {}
-        for row in sheet:
-            row_tup = tuple(row)
-            if row_tup in full_row_map:
-                # Skip/don't append duplicate rows
-                continue
-            full_row_map[row_tup] = True
-            no_exact_row_duplicates.append(row)
+        unique_rows = dict.fromkeys(map(tuple, sheet._data_rows()))
+        no_exact_row_duplicates.extend(map(list, unique_rows))
         # Reassign the sheet with the new data
         sheet = RowColumnView(no_exact_row_duplicates)
 
         no_conflicts = [source_headers]
         # Clean conflicting/partial day rows if this is a traffic CSV
-        if set(source_headers) >= set(Metrics.TRAFFIC_HDR_LIST):
-            unique_date_vers_path_map = {
+        if sheet._headers_set >= Metrics.TRAFFIC_HDR_SET:
+            winning_row_map = {
                 # Looks like
-                # (date, vers, path): [row, row2]
-                # Whole rows are stored for duplicates, most views wins
+                # (date, vers, path): row_position
+                # Position of the row with the most views (last one on ties)
             }
 
             idate = sheet.col_index(Metrics.THDRS.DATE)
             ivers = sheet.col_index(Metrics.THDRS.VERSION)
             ipath = sheet.col_index(Metrics.THDRS.PATH)
             iviews = sheet.col_index(Metrics.THDRS.VIEWS)
-            for row in sheet.rowsi():
-                # Find conflicts
+            rows = no_exact_row_duplicates
+            for position in range(1, len(rows)):
+                # Find conflicts, only parsing view counts when there is one
+                row = rows[position]
                 fingerprint = (row[idate], row[ivers], row[ipath])
-                unique_date_vers_path_map.setdefault(fingerprint, []).append(row)
-            for row in sheet.rowsi():
-                fingerprint = (row[idate], row[ivers], row[ipath])
-                matching_rows = unique_date_vers_path_map[fingerprint]
-                if len(matching_rows) == 1:
-                    no_conflicts.append(row)
-                else:
-                    most_first = list(reversed(sorted(matching_rows, key=lambda r: int(r[iviews]))))
-                    if most_first[0] == row:
-                        no_conflicts.append(row)
+                best = winning_row_map.get(fingerprint)
+                if best is None or int(row[iviews]) >= int(rows[best][iviews]):
+                    winning_row_map[fingerprint] = position
+            winners = sorted(winning_row_map.values())
+            no_conflicts.extend(rows[position] for position in winners)
         # Search CSVs don't need conflict resolution, only duplicate resolution
-        elif set(source_headers) >= set(Metrics.SEARCH_HDR_LIST):
-            no_conflicts.extend(sheet.rowsi())
+        elif sheet._headers_set >= Metrics.SEARCH_HDR_SET:
+            no_conflicts.extend(sheet.iter_rows_bulk())
 
         return no_conflicts
 
@@ -266,7 +301,7 @@ class Metrics(RowColumnView):
             # List of dicts, like:
             # {
             #      'type': Metrics.INPUTS.FILEHANDLE,
-            #      'data': RowColumnView(csv_to_rows_of_strings(foo)),
+            #      'read': Callable returning csv_to_rows_of_strings(foo),
             #      'source': src_object
             # }
         ]
@@ -276,7 +311,7 @@ class Metrics(RowColumnView):
             for cstring in csv_string:
                 sources.append({
                     'type': Metrics.INPUTS.CSV_STRING,
-                    'data': RowColumnView(csv_to_rows_of_strings(csv_string=cstring)),
+                    'read': functools.partial(csv_to_rows_of_strings, csv_string=cstring),
                     'source': cstring
                 })
         if filehandle is not None:
@@ -285,7 +320,7 @@ class Metrics(RowColumnView):
             for fhandle in filehandle:
                 sources.append({
                     'type': Metrics.INPUTS.FILEHANDLE,
-                    'data': RowColumnView(csv_to_rows_of_strings(filehandle=fhandle)),
+                    'read': functools.partial(csv_to_rows_of_strings, filehandle=fhandle),
                     'source': fhandle
                 })
         if path is not None:
@@ -294,19 +329,23 @@ class Metrics(RowColumnView):
             for pth in path:
                 sources.append({
                     'type': Metrics.INPUTS.PATH,
-                    'data': RowColumnView(csv_to_rows_of_strings(path=pth)),
+                    'read': functools.partial(csv_to_rows_of_strings, path=pth),
                     'source': pth
                 })
 
         metrics_type = None
         sources_normalized = []
+        verbatim = True  # Track if sources are already normalized, read from disk
         for item in sources:
+            # Sources are read one at a time, so only one raw sheet is held
+            # in memory alongside the normalized rows
+            source_sheet = RowColumnView(item['read']())
+
             # Figure out which metrics type we have
-            source_sheet = item['data']
             if metrics_type is None:
-                if set(source_sheet.headers()) >= set(Metrics.TRAFFIC_HDR_LIST):
+                if source_sheet._headers_set >= Metrics.TRAFFIC_HDR_SET:
                     metrics_type = Metrics.TYPES.TRAFFIC
-                elif set(source_sheet.headers()) >= set(Metrics.SEARCH_HDR_LIST):
+                elif source_sheet._headers_set >= Metrics.SEARCH_HDR_SET:
                     metrics_type = Metrics.TYPES.SEARCH
                 else:
                     raise ValueError(f'Error, unknown data format for {item}')
@@ -314,73 +353,124 @@ class Metrics(RowColumnView):
             # Metrics hold (one of) either traffic data or search data,
             # only same-types are merged
             if ((metrics_type == Metrics.TYPES.TRAFFIC
-                    and not set(source_sheet.headers()) >= set(Metrics.TRAFFIC_HDR_LIST))
+                    and not source_sheet._headers_set >= Metrics.TRAFFIC_HDR_SET)
                 or (metrics_type == Metrics.TYPES.SEARCH
-                    and not set(source_sheet.headers()) >= set(Metrics.SEARCH_HDR_LIST))):
+                    and not source_sheet._headers_set >= Metrics.SEARCH_HDR_SET)):
                 raise ValueError('Cannot merge disparate data types')
 
             sheet = RowColumnView(Metrics._normalize_sheet(source_sheet))
+            # A file only matches its normalized rows if _normalize_sheet
+            # reused them as they were (it reuses either all rows or none,
+            # e.g. rows with extra cells are rebuilt), so check the first
+            rows_reused = sheet.is_empty() or sheet[0] is source_sheet[0]
+            if (item['type'] != Metrics.INPUTS.PATH
+                    or source_sheet.headers() != sheet.headers()
+                    or not rows_reused):
+                verbatim = False
             if not sources_normalized:
                 # Take normalized headers from the item as first string row
                 sources_normalized.append(sheet.headers())
-            sources_normalized.extend(sheet.rowsi())
+            # (Normalized rows are new lists, so they don't need copying)
+            sources_normalized.extend(sheet.iter_rows_bulk())
 
+        row_count = len(sources_normalized)
         if postproc is not None:
             sources_normalized = postproc(sources_normalized)
 
-        return Metrics(sources_normalized)
+        # Rows are already normalized, unless a custom postproc changed them
+        # (a custom postproc may also reorder or rewrite rows, so the files
+        # on disk can't be assumed to match the sheet either)
+        if postproc is not None and postproc is not Metrics._clean_dups_and_merge:
+            return Metrics(sources_normalized)
+
+        metrics = Metrics._from_normalized(sources_normalized)
+        if verbatim and len(sources_normalized) == row_count:
+            # Nothing was reordered or removed, the files on disk match the sheet
+            metrics._verbatim_paths = [item['source'] for item in sources]
+        return metrics
+
+    @staticmethod
+    def classify(path):
+        """Sniff the metrics type of a CSV file without loading all of it
+
+        Only the header row and first data row are read. Returns a tuple of
+        (metrics_type, is_empty), where metrics_type is one of Metrics.TYPES
+        (or None if the columns don't match a known format).
+        """
+        with open(path, encoding='utf8', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            headers = next(reader, None)
+            if headers is None:
+                raise ValueError('Empty CSV with no headers!')
+            is_empty = next(reader, None) is None
+
+        if Metrics.TRAFFIC_HDR_SET.issubset(headers):
+            return Metrics.TYPES.TRAFFIC, is_empty
+        if Metrics.SEARCH_HDR_SET.issubset(headers):
+            return Metrics.TYPES.SEARCH, is_empty
+        return None, is_empty
+
+    def verbatim_source_paths(self):
+        """Return source CSV paths that hold exactly this sheet's data, or None
+
+        When every source was read from a path, already had the normalized
+        column layout, and merging removed no rows, the sheet's rows are just
+        the concatenated data rows of these files. Writers can then copy the
+        files directly instead of re-serializing every row.
+        """
+        if self._verbatim_paths is None:
+            return None
+        return list(self._verbatim_paths)
 
     def is_traffic(self):
-        if set(self.headers()) >= set(Metrics.TRAFFIC_HDR_LIST):
+        if self._headers_set >= Metrics.TRAFFIC_HDR_SET:
             return True
         return False
 
     def is_search(self):
-        if set(self.headers()) >= set(Metrics.SEARCH_HDR_LIST):
+        if self._headers_set >= Metrics.SEARCH_HDR_SET:
             return True
         return False
 
+    def _view_counts(self):
+        # Parse the Views column once, it's shared by the traffic aggregators
+        if self._views is None:
+            self._views = list(map(int, self.columni(Metrics.THDRS.VIEWS)))
+        return self._views
+
     def total_views(self):
         if not self.is_traffic():
             raise Exception('Cannot get views on non-traffic data')
 
-        view_index = self.col_index(Metrics.THDRS.VIEWS)
-        return sum(int(row[view_index]) for row in self._rows)
+        return sum(self._view_counts())
 
     def most_popular_queries(self, n=None):
         if not self.is_search():
             raise TypeError('Cannot get query counts for non-search data')
-        counts = collections.Counter()
-
-        headers = self.headers()
-        query_hdr_index = headers.index(Metrics.SHDRS.QUERY)
-        for row in self.rowsi():
-            # Each row is a search, so the row adds 1 to the count (query
-            # match count is also in each search row, but since the number
-            # of matches is not needed/relevant, we don't use it)
-            counts[row[query_hdr_index]] += 1
+        # Each row is a search, so the row adds 1 to the count (query
+        # match count is also in each search row, but since the number
+        # of matches is not needed/relevant, we don't use it)
+        counts = collections.Counter(self.columni(Metrics.SHDRS.QUERY))
         return counts.most_common() if n is None else counts.most_common(n)
 
     def most_popular_pages(self, n=None):
         if not self.is_traffic():
             raise TypeError('Cannot get traffic counts for non-traffic data')
-        counts = collections.Counter()
-
-        headers = self.headers()
-        path_hdr_index = headers.index(Metrics.THDRS.PATH)
-        views_hdr_index = headers.index(Metrics.THDRS.VIEWS)
-        for row in self.rowsi():
-            counts[row[path_hdr_index]] += int(row[views_hdr_index])
+        # (Sum into a defaultdict, Counter's += is slower per row)
+        totals = collections.defaultdict(int)
+        keys = self.columni(Metrics.THDRS.PATH)
+        for key, view_count in zip(keys, self._view_counts()):
+            totals[key] += view_count
+        counts = collections.Counter(totals)
         return counts.most_common() if n is None else counts.most_common(n)
 
     def most_popular_versions(self, n=None):
         if not self.is_traffic():
             raise TypeError('Cannot get version counts for non-traffic data')
-        counts = collections.Counter()
-
-        headers = self.headers()
-        path_hdr_index = headers.index(Metrics.THDRS.VERSION)
-        views_hdr_index = headers.index(Metrics.THDRS.VIEWS)
-        for row in self.rowsi():
-            counts[row[path_hdr_index]] += int(row[views_hdr_index])
+        # (Sum into a defaultdict, Counter's += is slower per row)
+        totals = collections.defaultdict(int)
+        keys = self.columni(Metrics.THDRS.VERSION)
+        for key, view_count in zip(keys, self._view_counts()):
+            totals[key] += view_count
+        counts = collections.Counter(totals)
         return counts.most_common() if n is None else counts.most_common(n)